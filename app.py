@@ -13,38 +13,62 @@ New in this upgrade:
 - Printable mark sheet for students
 
 How to run:
-1) pip install flask SQLAlchemy itsdangerous
+1) pip install flask SQLAlchemy itsdangerous argon2-cffi
 2) python app1.py
 3) Open http://127.0.0.1:5000
 
+To serve the stylesheet from this origin instead of the CDN, save
+https://cdn.jsdelivr.net/npm/@picocss/pico@2.0.6/css/pico.min.css as static/pico.min.css.
+
+For a deployment, create the database once (python -c "import app; app.init_db()")
+and serve the app from a long-lived WSGI server, e.g.
+    gunicorn --workers 4 --preload app:app
+Everything here is pure Python or cffi-based (argon2-cffi), so the same command
+also runs under PyPy3, whose JIT only pays off in such persistent workers.
+
 Default admin (auto-created):
 - username: admin
 - password: admin123
 
 NOTE: This keeps a simple UI using PicoCSS. In production, add HTTPS, strong secrets, proper email for reset links, and thorough validation.
 """
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime
-from typing import List, Optional, Tuple
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 import csv
+import hashlib
+import hmac
 import io
 import os
 import secrets
+import threading
 
 from flask import (
     Flask,
     abort,
     flash,
+    g,
     redirect,
     render_template,
     request,
     session,
     url_for,
-    send_file,
+    make_response,
+    Response,
+    stream_with_context,
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, UniqueConstraint
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker, scoped_session
-from jinja2 import DictLoader
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from sqlalchemy import create_engine, delete, event, exists, func, insert, select, text, update, column, Column, Integer, String, ForeignKey, DateTime, Table, UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker, scoped_session, selectinload, joinedload, raiseload
+from jinja2 import DictLoader, FileSystemBytecodeCache
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 # ----------------------------
@@ -53,8 +77,34 @@ from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 app = Flask(__name__)
 app.secret_key = os.environ.get("APP_SECRET", "dev-secret-change-me")
 
-engine = create_engine("sqlite:///results.db", echo=False, future=True)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False))
+engine = create_engine(
+    "sqlite:///results.db",
+    echo=False,
+    future=True,
+    connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=20,
+)
+
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+    "foreign_keys=ON",
+)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute("PRAGMA " + pragma)
+    cur.close()
+
+# Sessions are request-scoped (removed in shutdown_session), so objects never
+# outlive the data they were loaded with; no need to expire them on commit.
+SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False))
 Base = declarative_base()
 
 # ----------------------------
@@ -74,16 +124,17 @@ class ClassRoom(Base):
     name = Column(String(100), nullable=False)
     section = Column(String(10), nullable=True)
     students = relationship("Student", back_populates="classroom", cascade="all, delete")
+    subjects = relationship("Subject", back_populates="classroom", cascade="all, delete")
     __table_args__ = (UniqueConstraint("name", "section", name="uq_class_name_section"),)
 
 class Student(Base):
     __tablename__ = "students"
     id = Column(Integer, primary_key=True)
     reg_no = Column(String(50), unique=True, nullable=False)
-    name = Column(String(120), nullable=False)
+    name = Column(String(120), nullable=False, index=True)
     email = Column(String(120), unique=True, nullable=True)
     password_hash = Column(String(255), nullable=False)
-    class_id = Column(Integer, ForeignKey("classes.id"), nullable=False)
+    class_id = Column(Integer, ForeignKey("classes.id", ondelete="CASCADE"), nullable=False, index=True)
     classroom = relationship("ClassRoom", back_populates="students")
     results = relationship("Result", back_populates="student", cascade="all, delete")
 
@@ -91,16 +142,16 @@ class Subject(Base):
     __tablename__ = "subjects"
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
-    class_id = Column(Integer, ForeignKey("classes.id"), nullable=False)
-    classroom = relationship("ClassRoom")
+    class_id = Column(Integer, ForeignKey("classes.id", ondelete="CASCADE"), nullable=False, index=True)
+    classroom = relationship("ClassRoom", back_populates="subjects")
     results = relationship("Result", back_populates="subject", cascade="all, delete")
     __table_args__ = (UniqueConstraint("name", "class_id", name="uq_subject_name_class"),)
 
 class Result(Base):
     __tablename__ = "results"
     id = Column(Integer, primary_key=True)
-    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
-    subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=False)
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), nullable=False)
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"), nullable=False, index=True)
     marks = Column(Integer, nullable=False)
     max_marks = Column(Integer, nullable=False, default=100)
     student = relationship("Student", back_populates="results")
@@ -108,25 +159,146 @@ class Result(Base):
     __table_args__ = (UniqueConstraint("student_id", "subject_id", name="uq_result_student_subject"),)
 
 # ----------------------------
-# Utilities: DB, Auth, CSRF, Tokens, Grades
+# Table versions
+# ----------------------------
+# A per-table counter bumped by triggers on every insert/update/delete, so any
+# worker (or a bulk Core statement) changing a table moves its version. Used
+# for page ETags; row counts and max ids can repeat once SQLite reuses a rowid.
+table_versions = Table(
+    "table_versions",
+    Base.metadata,
+    Column("name", String(50), primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+)
+VERSIONED_TABLES = ("classes", "subjects", "admin_users")
+# Set once the table, seed rows and triggers are known to exist; databases that
+# predate them get them on first use, not only when init_db() is re-run
+table_versions_ready = False
+
+def init_table_versions():
+    global table_versions_ready
+    table_versions.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for name in VERSIONED_TABLES:
+            conn.execute(text("INSERT OR IGNORE INTO table_versions (name, version) VALUES (:name, 0)"), {"name": name})
+            for op in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {name}_version_{op.lower()} AFTER {op} ON {name} BEGIN "
+                    f"UPDATE table_versions SET version = version + 1 WHERE name = '{name}'; END"
+                ))
+    table_versions_ready = True
+
+# ----------------------------
+# Student search index (SQLite FTS5)
+# ----------------------------
+# A trigram index keeps the "substring of name or reg no" search semantics while
+# letting SQLite answer from the index instead of scanning every student.
+# Triggers keep it in sync with the students table.
+STUDENT_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5("
+    "name, reg_no, content='students', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN "
+    "INSERT INTO students_fts(rowid, name, reg_no) VALUES (new.id, new.name, new.reg_no); END",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, name, reg_no) VALUES ('delete', old.id, old.name, old.reg_no); END",
+    "CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE ON students BEGIN "
+    "INSERT INTO students_fts(students_fts, rowid, name, reg_no) VALUES ('delete', old.id, old.name, old.reg_no); "
+    "INSERT INTO students_fts(rowid, name, reg_no) VALUES (new.id, new.name, new.reg_no); END",
+)
+STUDENT_FTS_MIN_QUERY = 3  # trigrams cannot match anything shorter
+# None until known: set by init_student_search(), or probed on the first search
+# in processes (e.g. WSGI workers) that never ran init_db()
+student_fts_enabled: Optional[bool] = None
+
+def init_student_search():
+    global student_fts_enabled
+    try:
+        with engine.begin() as conn:
+            created = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'students_fts'")).first() is None
+            for stmt in STUDENT_FTS_DDL:
+                conn.execute(text(stmt))
+            if created:
+                conn.execute(text("INSERT INTO students_fts(students_fts) VALUES ('rebuild')"))
+    except OperationalError:
+        app.logger.warning("SQLite lacks FTS5 trigram support; student search falls back to LIKE")
+        return
+    student_fts_enabled = True
+
+def student_fts_usable() -> bool:
+    global student_fts_enabled
+    if student_fts_enabled is None:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT rowid FROM students_fts LIMIT 0"))
+            student_fts_enabled = True
+        except OperationalError:
+            student_fts_enabled = False
+    return student_fts_enabled
+
+def student_search_filter(q: str):
+    if len(q) >= STUDENT_FTS_MIN_QUERY and student_fts_usable():
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = (
+            text("SELECT rowid FROM students_fts WHERE students_fts MATCH :q")
+            .bindparams(q=phrase)
+            .columns(column("rowid", Integer))
+        )
+        return Student.id.in_(matches)
+    like = f"%{q}%"
+    return (Student.name.ilike(like)) | (Student.reg_no.ilike(like))
+
+# ----------------------------
+# Utilities: DB, Auth, CSRF, Tokens, Grades, CSV
 # ----------------------------
 
 def get_db():
     return SessionLocal()
 
+@app.teardown_appcontext
+def shutdown_session(exc=None):
+    # Drop the thread's session (and its identity map) at the end of each request
+    SessionLocal.remove()
+
+@event.listens_for(SessionLocal.session_factory, "do_orm_execute")
+def _raise_on_lazy_load(state):
+    # In debug mode any relationship a query didn't eager-load raises when
+    # touched, so a new N+1 in a view or template fails loudly in development
+    if app.debug and state.is_select and not state.is_column_load and not state.is_relationship_load:
+        state.statement = state.statement.options(raiseload("*"))
+
 # --- CSRF (simple session token) ---
 CSRF_SESSION_KEY = "_csrf_token"
+CSRF_TOKEN_BYTES = 16
+CSRF_POOL_SIZE = 256
+
+# New sessions draw tokens from a pool filled by one urandom read per
+# CSRF_POOL_SIZE tokens instead of one read per session.
+_csrf_pool: "deque[str]" = deque()
+_csrf_pool_lock = threading.Lock()
+
+def _new_csrf_token() -> str:
+    with _csrf_pool_lock:
+        if not _csrf_pool:
+            buf = secrets.token_bytes(CSRF_TOKEN_BYTES * CSRF_POOL_SIZE)
+            _csrf_pool.extend(
+                buf[i:i + CSRF_TOKEN_BYTES].hex() for i in range(0, len(buf), CSRF_TOKEN_BYTES)
+            )
+        return _csrf_pool.popleft()
 
 def get_csrf_token() -> str:
+    # Templates call csrf_token() once per form; resolve it once per request
+    if "csrf_token" in g:
+        return g.csrf_token
     token = session.get(CSRF_SESSION_KEY)
     if not token:
-        token = secrets.token_hex(16)
+        token = _new_csrf_token()
         session[CSRF_SESSION_KEY] = token
+    g.csrf_token = token
     return token
 
-@app.context_processor
-def inject_csrf():
-    return {"csrf_token": get_csrf_token}
+# A Jinja global rather than a context processor: nothing runs per render
+# until a template actually calls csrf_token()
+app.jinja_env.globals["csrf_token"] = get_csrf_token
 
 def require_csrf():
     form_token = request.form.get("csrf_token")
@@ -149,13 +321,90 @@ def require_admin(role: Optional[str] = None):
         flash("Insufficient privileges.", "warning")
         return redirect(url_for("admin_dashboard"))
 
+def admin_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not is_admin_logged_in():
+            return require_admin()
+        return view(*args, **kwargs)
+    return wrapped
 
-def is_student_logged_in() -> bool:
-    return session.get("student_id") is not None
 
 def current_student_id() -> Optional[int]:
     return session.get("student_id")
 
+def current_student() -> Optional["Student"]:
+    # Loaded at most once per request; None if the account was deleted
+    if "student" not in g:
+        sid = current_student_id()
+        g.student = (
+            get_db().get(Student, sid, options=[joinedload(Student.classroom)])
+            if sid is not None else None
+        )
+    return g.student
+
+# --- Password hashing ---
+# New hashes use argon2id. Hashes written before the switch are Werkzeug
+# pbkdf2/scrypt strings; they still verify and are upgraded on the next login.
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
+def hash_password(password: str) -> str:
+    return _password_hasher.hash(password)
+
+DEFAULT_STUDENT_PASSWORD = "Pass@123"
+
+@lru_cache(maxsize=None)
+def default_student_password_hash() -> str:
+    # Shared by every CSV-imported student, so hash it once per process
+    return hash_password(DEFAULT_STUDENT_PASSWORD)
+
+# argon2-cffi drops the GIL while hashing, so threads spread a bulk import's
+# hashes across cores. Each hash holds memory_cost KiB, hence the small cap.
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+
+def password_needs_rehash(password_hash: str) -> bool:
+    if not password_hash.startswith("$argon2"):
+        return True
+    return _password_hasher.check_needs_rehash(password_hash)
+
+def _check_password(password_hash: str, password: str) -> bool:
+    if not password_hash.startswith("$argon2"):
+        return check_password_hash(password_hash, password)
+    try:
+        return _password_hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+# --- Password verification (memoized) ---
+# Hash verification is deliberately slow, so remember recent outcomes keyed
+# on the stored hash plus an HMAC of the submitted password (never the
+# password itself). A changed password means a new stored hash, so stale
+# entries simply stop matching. Only successes are kept: every failure, for a
+# real account or via DUMMY_PASSWORD_HASH, pays the full hash, so response
+# time cannot tell unknown usernames apart from wrong passwords.
+PASSWORD_CACHE_SIZE = 1024
+_password_cache: "OrderedDict[Tuple[str, bytes], None]" = OrderedDict()
+_password_cache_lock = threading.Lock()
+
+# Checked against when the account does not exist, so unknown usernames cost
+# the same hash work as known ones and cannot be told apart by timing.
+DUMMY_PASSWORD_HASH = hash_password(secrets.token_hex(16))
+
+def verify_password(password_hash: str, password: str) -> bool:
+    digest = hmac.new(app.secret_key.encode(), password.encode(), hashlib.sha256).digest()
+    key = (password_hash, digest)
+    with _password_cache_lock:
+        if key in _password_cache:
+            _password_cache.move_to_end(key)
+            return True
+    if not _check_password(password_hash, password):
+        return False
+    with _password_cache_lock:
+        _password_cache[key] = None
+        if len(_password_cache) > PASSWORD_CACHE_SIZE:
+            _password_cache.popitem(last=False)
+    return True
+
 # --- Token for password reset ---
 
 def serializer() -> URLSafeTimedSerializer:
@@ -163,24 +412,138 @@ def serializer() -> URLSafeTimedSerializer:
 
 # --- Grades ---
 
-def compute_totals(results: List[Result]) -> Tuple[int, int, float, str]:
-    total = sum(r.marks for r in results)
-    max_total = sum(r.max_marks for r in results) or 1
+# Lower percentage bound of each grade above F, ascending
+GRADE_THRESHOLDS = (40, 50, 60, 70, 80, 90)
+GRADE_LETTERS = ("F", "D", "C", "B", "B+", "A", "A+")
+
+def grade_for(percentage: float) -> str:
+    return GRADE_LETTERS[bisect_right(GRADE_THRESHOLDS, percentage)]
+
+def compute_totals(results: Iterable[Tuple[str, int, int]]) -> Tuple[int, int, float, str]:
+    total = max_total = 0
+    for _, marks, max_marks in results:
+        total += marks
+        max_total += max_marks
+    max_total = max_total or 1
     percentage = round((total / max_total) * 100, 2)
-    grade = (
-        "A+" if percentage >= 90 else
-        "A" if percentage >= 80 else
-        "B+" if percentage >= 70 else
-        "B" if percentage >= 60 else
-        "C" if percentage >= 50 else
-        "D" if percentage >= 40 else
-        "F"
+    return total, max_total, percentage, grade_for(percentage)
+
+def load_results(db, student_id: int) -> List[Tuple[str, int, int]]:
+    """(subject name, marks, max marks) rows for a student, as plain tuples."""
+    stmt = (
+        select(Subject.name, Result.marks, Result.max_marks)
+        .join(Result, Result.subject_id == Subject.id)
+        .where(Result.student_id == student_id)
+        .order_by(Subject.name)
+    )
+    return db.execute(stmt).all()
+
+# The class list feeds the dropdowns on most admin pages but rarely changes.
+# Rows are kept per process and checked against the trigger-maintained classes
+# version, so a class added or deleted by any worker shows up on the next page.
+_class_list: Optional[Tuple[tuple, list]] = None  # (classes version, rows)
+
+def list_classes(db) -> list:
+    global _class_list
+    # Version first: rows read after a concurrent write are stored under the
+    # older version and simply re-read on the next call
+    version = table_fingerprint(db, ClassRoom)
+    cached = _class_list
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    rows = db.execute(
+        select(ClassRoom.id, ClassRoom.name, ClassRoom.section).order_by(ClassRoom.name, ClassRoom.section)
+    ).all()
+    _class_list = (version, rows)
+    return rows
+
+def dashboard_stats(db):
+    """Row counts for the dashboard, fetched as one SELECT of scalar subqueries."""
+    return db.execute(
+        select(
+            select(func.count()).select_from(ClassRoom).scalar_subquery().label("classes"),
+            select(func.count()).select_from(Student).scalar_subquery().label("students"),
+            select(func.count()).select_from(Subject).scalar_subquery().label("subjects"),
+            select(func.count()).select_from(Result).scalar_subquery().label("results"),
+        )
+    ).one()
+
+# --- Bulk deletes ---
+# One DELETE ... WHERE id IN (...) per table instead of loading every object
+# and letting the ORM cascade row by row. Children are removed explicitly so
+# databases created before the FKs gained ON DELETE CASCADE behave the same.
+
+def delete_students(db, ids: Sequence[int]) -> int:
+    db.execute(delete(Result).where(Result.student_id.in_(ids)))
+    return db.execute(delete(Student).where(Student.id.in_(ids))).rowcount
+
+def delete_subjects(db, ids: Sequence[int]) -> int:
+    db.execute(delete(Result).where(Result.subject_id.in_(ids)))
+    return db.execute(delete(Subject).where(Subject.id.in_(ids))).rowcount
+
+def delete_classes(db, ids: Sequence[int]) -> int:
+    students = select(Student.id).where(Student.class_id.in_(ids))
+    subjects = select(Subject.id).where(Subject.class_id.in_(ids))
+    db.execute(delete(Result).where(Result.student_id.in_(students) | Result.subject_id.in_(subjects)))
+    db.execute(delete(Student).where(Student.class_id.in_(ids)))
+    db.execute(delete(Subject).where(Subject.class_id.in_(ids)))
+    return db.execute(delete(ClassRoom).where(ClassRoom.id.in_(ids))).rowcount
+
+# --- Results upsert ---
+
+def result_upsert():
+    """INSERT a result, or overwrite the marks if the student/subject pair exists."""
+    stmt = sqlite_insert(Result.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["student_id", "subject_id"],
+        set_={"marks": stmt.excluded.marks, "max_marks": stmt.excluded.max_marks},
+    )
+
+# --- CSV import/export ---
+CSV_STREAM_BATCH = 500
+CSV_IMPORT_BATCH = 1000
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+def iter_csv(header: Sequence, rows: Iterable[Sequence]) -> Iterator[str]:
+    """Yield the header, then CSV text in chunks of CSV_STREAM_BATCH rows."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(header)
+    yield buf.getvalue()
+    for batch in batched(rows, CSV_STREAM_BATCH):
+        buf.seek(0)
+        buf.truncate()
+        w.writerows(batch)
+        yield buf.getvalue()
+
+def csv_response(filename: str, chunks: Iterator[str]) -> Response:
+    return Response(
+        stream_with_context(chunks),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
-    return total, max_total, percentage, grade
 
 # ----------------------------
 # Templates (DictLoader)
 # ----------------------------
+# Pico is served from this origin when static/pico.min.css is present, with a
+# versioned URL so it can be cached for a year; otherwise from the CDN, pinned
+# to an exact release so those responses are long-lived too.
+PICO_VERSION = "2.0.6"
+if os.path.exists(os.path.join(app.static_folder, "pico.min.css")):
+    PICO_CSS_URL = f"{app.static_url_path}/pico.min.css?v={PICO_VERSION}"
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 365 * 24 * 3600
+else:
+    PICO_CSS_URL = f"https://cdn.jsdelivr.net/npm/@picocss/pico@{PICO_VERSION}/css/pico.min.css"
+app.jinja_env.globals["pico_css_url"] = PICO_CSS_URL
+
 TEMPLATES = {
     "base.html": """
     <!doctype html>
@@ -189,7 +552,7 @@ TEMPLATES = {
         <meta charset=\"utf-8\" />
         <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
         <title>{% block title %}Result Manager{% endblock %}</title>
-        <link rel=\"stylesheet\" href=\"https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css\" />
+        <link rel=\"stylesheet\" href=\"{{ pico_css_url }}\" />
         <style>
             .container { max-width: 1000px; margin: auto; }
             .muted { color: #777; font-size: .9rem; }
@@ -260,6 +623,12 @@ TEMPLATES = {
     {% block title %}Admin Dashboard{% endblock %}
     {% block content %}
     <h2>Admin Dashboard</h2>
+    <p>
+        <span class=\"badge\">{{ stats.classes }} classes</span>
+        <span class=\"badge\">{{ stats.students }} students</span>
+        <span class=\"badge\">{{ stats.subjects }} subjects</span>
+        <span class=\"badge\">{{ stats.results }} results</span>
+    </p>
     <p class=\"no-print\">
         <a href=\"{{ url_for('admin_classes') }}\" role=\"button\">Classes</a>
         <a href=\"{{ url_for('admin_students') }}\" role=\"button\">Students</a>
@@ -293,6 +662,18 @@ TEMPLATES = {
     </details>
     {% endblock %}
     """,
+    "student_reset.html": """
+    {% extends 'base.html' %}
+    {% block title %}Reset Password{% endblock %}
+    {% block content %}
+    <h2>Set New Password</h2>
+    <form method=\"post\">
+        <input type=\"hidden\" name=\"csrf_token\" value=\"{{ csrf_token() }}\" />
+        <label>New Password <input type=\"password\" name=\"password\" required></label>
+        <button type=\"submit\">Save</button>
+    </form>
+    {% endblock %}
+    """,
     "student_portal.html": """
     {% extends 'base.html' %}
     {% block title %}My Results{% endblock %}
@@ -305,8 +686,8 @@ TEMPLATES = {
     <table>
         <thead><tr><th>Subject</th><th>Marks</th><th>Max</th></tr></thead>
         <tbody>
-        {% for r in results %}
-            <tr><td>{{ r.subject.name }}</td><td>{{ r.marks }}</td><td>{{ r.max_marks }}</td></tr>
+        {% for name, marks, max_marks in results %}
+            <tr><td>{{ name }}</td><td>{{ marks }}</td><td>{{ max_marks }}</td></tr>
         {% endfor %}
         </tbody>
     </table>
@@ -332,8 +713,8 @@ TEMPLATES = {
       <table>
         <thead><tr><th>Subject</th><th>Marks</th><th>Max</th></tr></thead>
         <tbody>
-        {% for r in results %}
-          <tr><td>{{ r.subject.name }}</td><td>{{ r.marks }}</td><td>{{ r.max_marks }}</td></tr>
+        {% for name, marks, max_marks in results %}
+          <tr><td>{{ name }}</td><td>{{ marks }}</td><td>{{ max_marks }}</td></tr>
         {% endfor %}
         </tbody>
       </table>
@@ -359,12 +740,16 @@ TEMPLATES = {
         <button type=\"submit\">Add</button>
       </form>
     </details>
+    <form id=\"bulk-delete\" class=\"no-print\" method=\"post\" action=\"{{ url_for('admin_bulk_delete', entity='classes') }}\" onsubmit=\"return confirm('Delete selected classes?');\">
+      <input type=\"hidden\" name=\"csrf_token\" value=\"{{ csrf_token() }}\" />
+      <button class=\"contrast\">Delete selected</button>
+    </form>
     <table>
-      <thead><tr><th>ID</th><th>Name</th><th>Section</th><th class=\"no-print\"></th></tr></thead>
+      <thead><tr><th class=\"no-print\"></th><th>ID</th><th>Name</th><th>Section</th><th class=\"no-print\"></th></tr></thead>
       <tbody>
         {% for c in classes %}
           <tr>
-            <td>{{ c.id }}</td><td>{{ c.name }}</td><td>{{ c.section or '-' }}</td>
+            <td class=\"no-print\"><input type=\"checkbox\" name=\"ids\" value=\"{{ c.id }}\" form=\"bulk-delete\"></td><td>{{ c.id }}</td><td>{{ c.name }}</td><td>{{ c.section or '-' }}</td>
             <td class=\"no-print\">
               <form method=\"post\" action=\"{{ url_for('admin_classes_delete', class_id=c.id) }}\" onsubmit=\"return confirm('Delete class?');\">
                 <input type=\"hidden\" name=\"csrf_token\" value=\"{{ csrf_token() }}\" />
@@ -427,11 +812,16 @@ TEMPLATES = {
       </details>
     </p>
 
+    <form id=\"bulk-delete\" class=\"no-print\" method=\"post\" action=\"{{ url_for('admin_bulk_delete', entity='students') }}\" onsubmit=\"return confirm('Delete selected students?');\">
+      <input type=\"hidden\" name=\"csrf_token\" value=\"{{ csrf_token() }}\" />
+      <button class=\"contrast\">Delete selected</button>
+    </form>
     <table>
-      <thead><tr><th>ID</th><th>Reg No</th><th>Name</th><th>Email</th><th>Class</th><th class=\"no-print\"></th></tr></thead>
+      <thead><tr><th class=\"no-print\"></th><th>ID</th><th>Reg No</th><th>Name</th><th>Email</th><th>Class</th><th class=\"no-print\"></th></tr></thead>
       <tbody>
         {% for s in students %}
         <tr>
+          <td class=\"no-print\"><input type=\"checkbox\" name=\"ids\" value=\"{{ s.id }}\" form=\"bulk-delete\"></td>
           <td>{{ s.id }}</td>
           <td>{{ s.reg_no }}</td>
           <td>{{ s.name }}</td>
@@ -450,9 +840,8 @@ TEMPLATES = {
 
     <nav class=\"no-print\">
       <ul>
-        {% if page>1 %}<li><a href=\"?q={{q}}&pp={{pp}}&page={{page-1}}\">Prev</a></li>{% endif %}
-        <li>Page {{page}}</li>
-        {% if has_more %}<li><a href=\"?q={{q}}&pp={{pp}}&page={{page+1}}\">Next</a></li>{% endif %}
+        {% if has_prev and students %}<li><a href=\"{{ url_for('admin_students', q=q, pp=pp, before_id=students[0].id) }}\">Prev</a></li>{% endif %}
+        {% if has_more and students %}<li><a href=\"{{ url_for('admin_students', q=q, pp=pp, after_id=students[-1].id) }}\">Next</a></li>{% endif %}
       </ul>
     </nav>
     {% endblock %}
@@ -480,11 +869,16 @@ TEMPLATES = {
       </form>
     </details>
 
+    <form id=\"bulk-delete\" class=\"no-print\" method=\"post\" action=\"{{ url_for('admin_bulk_delete', entity='subjects') }}\" onsubmit=\"return confirm('Delete selected subjects?');\">
+      <input type=\"hidden\" name=\"csrf_token\" value=\"{{ csrf_token() }}\" />
+      <button class=\"contrast\">Delete selected</button>
+    </form>
     <table>
-      <thead><tr><th>ID</th><th>Name</th><th>Class</th><th class=\"no-print\"></th></tr></thead>
+      <thead><tr><th class=\"no-print\"></th><th>ID</th><th>Name</th><th>Class</th><th class=\"no-print\"></th></tr></thead>
       <tbody>
         {% for s in subjects %}
         <tr>
+          <td class=\"no-print\"><input type=\"checkbox\" name=\"ids\" value=\"{{ s.id }}\" form=\"bulk-delete\"></td>
           <td>{{ s.id }}</td>
           <td>{{ s.name }}</td>
           <td>{{ s.classroom.name }}{% if s.classroom.section %} - {{ s.classroom.section }}{% endif %}</td>
@@ -604,13 +998,58 @@ TEMPLATES = {
 }
 
 app.jinja_loader = DictLoader(TEMPLATES)
+# Templates live in this module, so reload checks buy nothing. Compile them all
+# up front (forked workers inherit the warm cache) and keep the bytecode on disk
+# so a restart skips parsing.
+app.jinja_env.auto_reload = False
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+for _name in TEMPLATES:
+    app.jinja_env.get_template(_name)
+
+# Pages whose only per-visitor content is the CSRF token and flash messages are
+# rendered once with a placeholder token; later hits just swap the real one in.
+CSRF_PLACEHOLDER = "__csrf_token__"
+_page_cache: Dict[str, str] = {}
+
+def render_cached(template: str) -> str:
+    if "_flashes" in session:
+        return render_template(template)
+    body = _page_cache.get(template)
+    if body is None:
+        body = _page_cache[template] = render_template(template, csrf_token=lambda: CSRF_PLACEHOLDER)
+    if CSRF_PLACEHOLDER in body:
+        body = body.replace(CSRF_PLACEHOLDER, get_csrf_token())
+    return body
+
+# Admin list pages are revalidated with an ETag built from the table_versions
+# counters of the tables they show, so an unchanged page costs one primary-key
+# lookup instead of the list query plus a render.
+
+def table_fingerprint(db, *models) -> tuple:
+    if not table_versions_ready:
+        init_table_versions()
+    names = [model.__tablename__ for model in models]
+    versions = dict(db.execute(
+        select(table_versions.c.name, table_versions.c.version).where(table_versions.c.name.in_(names))
+    ).all())
+    return tuple(versions[name] for name in names)
+
+def conditional_page(fingerprint: tuple, render: Callable[[], str]) -> Response:
+    etag = hashlib.md5(repr((fingerprint, get_csrf_token())).encode()).hexdigest()
+    if "_flashes" not in session and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = make_response(render())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 # ----------------------------
 # Routes - Public
 # ----------------------------
 @app.route("/")
 def home():
-    return render_template("home.html")
+    return render_cached("home.html")
 
 # ----------------------------
 # Routes - Admin Auth & Dashboard
@@ -622,14 +1061,25 @@ def admin_login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
         db = get_db()
-        user = db.query(AdminUser).filter_by(username=username).first()
-        if user and check_password_hash(user.password_hash, password):
+        account = db.execute(
+            select(AdminUser.password_hash, AdminUser.role).where(AdminUser.username == username)
+        ).first()
+        ok = verify_password(account.password_hash if account else DUMMY_PASSWORD_HASH, password)
+        if account and ok:
+            role = account.role
+            if password_needs_rehash(account.password_hash):
+                db.execute(
+                    update(AdminUser)
+                    .where(AdminUser.username == username)
+                    .values(password_hash=hash_password(password))
+                )
+                db.commit()
             session["admin_logged_in"] = True
-            session["admin_role"] = user.role
-            flash("Welcome, %s!" % user.role, "success")
+            session["admin_role"] = role
+            flash("Welcome, %s!" % role, "success")
             return redirect(url_for("admin_dashboard"))
         flash("Invalid credentials", "warning")
-    return render_template("admin_login.html")
+    return render_cached("admin_login.html")
 
 @app.route("/admin/logout")
 def admin_logout():
@@ -639,26 +1089,23 @@ def admin_logout():
     return redirect(url_for("home"))
 
 @app.route("/admin")
+@admin_required
 def admin_dashboard():
-    if not is_admin_logged_in():
-        return require_admin()
-    return render_template("admin_dashboard.html")
+    return render_template("admin_dashboard.html", stats=dashboard_stats(get_db()))
 
 # ----------------------------
 # Admin: Classes
 # ----------------------------
 @app.route("/admin/classes")
+@admin_required
 def admin_classes():
-    if not is_admin_logged_in():
-        return require_admin()
     db = get_db()
-    classes = db.query(ClassRoom).order_by(ClassRoom.name, ClassRoom.section).all()
+    classes = list_classes(db)
     return render_template("classes.html", classes=classes)
 
 @app.route("/admin/classes/add", methods=["POST"])
+@admin_required
 def admin_classes_add():
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     name = request.form.get("name", "").strip()
     section = (request.form.get("section", "").strip() or None)
@@ -677,15 +1124,12 @@ def admin_classes_add():
     return redirect(url_for("admin_classes"))
 
 @app.route("/admin/classes/<int:class_id>/delete", methods=["POST"])
+@admin_required
 def admin_classes_delete(class_id: int):
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     db = get_db()
-    obj = db.get(ClassRoom, class_id)
-    if not obj:
+    if not delete_classes(db, [class_id]):
         abort(404)
-    db.delete(obj)
     db.commit()
     flash("Class deleted", "info")
     return redirect(url_for("admin_classes"))
@@ -693,28 +1137,39 @@ def admin_classes_delete(class_id: int):
 # ----------------------------
 # Admin: Students (with search & pagination) + CSV
 # ----------------------------
+STUDENTS_MAX_PER_PAGE = 100
+
 @app.route("/admin/students")
+@admin_required
 def admin_students():
-    if not is_admin_logged_in():
-        return require_admin()
     db = get_db()
     q = request.args.get("q", "").strip() or None
-    page = max(1, request.args.get("page", type=int, default=1))
-    pp = request.args.get("pp", type=int, default=10)
-    query = db.query(Student)
+    pp = max(1, min(request.args.get("pp", type=int, default=10), STUDENTS_MAX_PER_PAGE))
+    # Keyset pagination on Student.id (newest first): after_id walks forward,
+    # before_id walks back. One extra row tells us whether another page exists.
+    after_id = request.args.get("after_id", type=int)
+    before_id = request.args.get("before_id", type=int)
+    stmt = select(Student).options(selectinload(Student.classroom))
     if q:
-        like = f"%{q}%"
-        query = query.filter((Student.name.ilike(like)) | (Student.reg_no.ilike(like)))
-    total_count = query.count()
-    students = query.order_by(Student.id.desc()).limit(pp).offset((page-1)*pp).all()
-    has_more = page * pp < total_count
-    classes = db.query(ClassRoom).order_by(ClassRoom.name, ClassRoom.section).all()
-    return render_template("students.html", students=students, classes=classes, q=q, page=page, pp=pp, has_more=has_more)
+        stmt = stmt.where(student_search_filter(q))
+    if before_id is not None:
+        rows = db.scalars(stmt.where(Student.id > before_id).order_by(Student.id.asc()).limit(pp + 1)).all()
+        has_prev = len(rows) > pp
+        students = rows[:pp][::-1]
+        has_more = True
+    else:
+        if after_id is not None:
+            stmt = stmt.where(Student.id < after_id)
+        rows = db.scalars(stmt.order_by(Student.id.desc()).limit(pp + 1)).all()
+        has_prev = after_id is not None
+        students = rows[:pp]
+        has_more = len(rows) > pp
+    classes = list_classes(db)
+    return render_template("students.html", students=students, classes=classes, q=q, pp=pp, has_prev=has_prev, has_more=has_more)
 
 @app.route("/admin/students/add", methods=["POST"])
+@admin_required
 def admin_students_add():
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     reg_no = request.form.get("reg_no", "").strip()
     name = request.form.get("name", "").strip()
@@ -730,7 +1185,7 @@ def admin_students_add():
         name=name,
         email=email,
         class_id=int(class_id),
-        password_hash=generate_password_hash(password),
+        password_hash=hash_password(password),
     )
     db.add(s)
     try:
@@ -742,75 +1197,115 @@ def admin_students_add():
     return redirect(url_for("admin_students"))
 
 @app.route("/admin/students/<int:student_id>/delete", methods=["POST"])
+@admin_required
 def admin_students_delete(student_id: int):
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     db = get_db()
-    s = db.get(Student, student_id)
-    if not s:
+    if not delete_students(db, [student_id]):
         abort(404)
-    db.delete(s)
     db.commit()
     flash("Student deleted", "info")
     return redirect(url_for("admin_students"))
 
 @app.route("/admin/students/export")
+@admin_required
 def admin_students_export():
-    if not is_admin_logged_in():
-        return require_admin()
     db = get_db()
-    buf = io.StringIO()
-    w = csv.writer(buf)
-    w.writerow(["reg_no", "name", "email", "class_name", "section"])
-    for s in db.query(Student).join(ClassRoom).all():
-        w.writerow([s.reg_no, s.name, s.email or "", s.classroom.name, s.classroom.section or ""])
-    buf.seek(0)
-    return send_file(io.BytesIO(buf.read().encode("utf-8")), as_attachment=True, download_name="students.csv", mimetype="text/csv")
+    stmt = select(
+        Student.reg_no,
+        Student.name,
+        func.coalesce(Student.email, ""),
+        ClassRoom.name,
+        func.coalesce(ClassRoom.section, ""),
+    ).join(Student.classroom)
+    rows = db.execute(stmt.execution_options(yield_per=1000))
+    return csv_response("students.csv", iter_csv(["reg_no", "name", "email", "class_name", "section"], rows))
 
 @app.route("/admin/students/import", methods=["POST"])
+@admin_required
 def admin_students_import():
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     file = request.files.get("file")
     if not file:
         flash("No file uploaded", "warning")
         return redirect(url_for("admin_students"))
     db = get_db()
-    reader = csv.DictReader(io.StringIO(file.read().decode("utf-8")))
+    reader = csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8", newline=""))
+    # Look everything up once up front and insert in batches, one transaction.
+    # The class memo lives only for this request so it never outlives a class.
+    classes: Dict[Tuple[str, Optional[str]], int] = {}
+    existing = set(db.scalars(select(Student.reg_no)))
+    # Known email clashes are skipped here rather than left to OR IGNORE, so a
+    # row that would be dropped never pays for hashing its password
+    emails = set(db.scalars(select(Student.email).where(Student.email.is_not(None))))
+    default_hash = default_student_password_hash()
+
+    def new_students():
+        for row in reader:
+            reg_no = row.get("reg_no")
+            email = row.get("email") or None
+            if reg_no in existing or email in emails:
+                continue
+            key = (row.get("class_name"), row.get("section") or None)
+            class_id = classes.get(key)
+            if class_id is None:
+                class_id = db.scalar(
+                    select(ClassRoom.id).where(ClassRoom.name == key[0], ClassRoom.section == key[1])
+                )
+            if class_id is None:
+                class_obj = ClassRoom(name=key[0], section=key[1])
+                db.add(class_obj)
+                db.flush()
+                class_id = class_obj.id
+            classes[key] = class_id
+            existing.add(reg_no)
+            if email:
+                emails.add(email)
+            yield dict(reg_no=reg_no, name=row.get("name"), email=email, class_id=class_id, password=row.get("password") or None)
+
+    def with_hashes(batch, pool):
+        # Rows without a password column share the cached default hash
+        own = [r for r in batch if r["password"]]
+        for r, h in zip(own, pool.map(hash_password, [r["password"] for r in own])):
+            r["password_hash"] = h
+        for r in batch:
+            r.setdefault("password_hash", default_hash)
+            del r["password"]
+        return batch
+
+    # Core executemany skips ORM bookkeeping; OR IGNORE still drops a row that
+    # clashes with one committed concurrently instead of failing the upload
+    stmt = insert(Student.__table__).prefix_with("OR IGNORE")
     created = 0
-    for row in reader:
-        class_obj = db.query(ClassRoom).filter_by(name=row.get("class_name"), section=(row.get("section") or None)).first()
-        if not class_obj:
-            class_obj = ClassRoom(name=row.get("class_name"), section=(row.get("section") or None))
-            db.add(class_obj)
-            db.flush()
-        reg_no = row.get("reg_no")
-        if not db.query(Student).filter_by(reg_no=reg_no).first():
-            s = Student(reg_no=reg_no, name=row.get("name"), email=row.get("email") or None, class_id=class_obj.id, password_hash=generate_password_hash("Pass@123"))
-            db.add(s)
-            created += 1
+    # Pool per import: its threads end with the request instead of living on in
+    # the process (and are never around when a preloading server forks)
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash") as pool:
+        for batch in batched(new_students(), CSV_IMPORT_BATCH):
+            created += db.execute(stmt, with_hashes(batch, pool)).rowcount
     db.commit()
-    flash(f"Imported {created} students (default password Pass@123)", "success")
+    flash(f"Imported {created} students (default password {DEFAULT_STUDENT_PASSWORD} where none given)", "success")
     return redirect(url_for("admin_students"))
 
 # ----------------------------
 # Admin: Subjects
 # ----------------------------
 @app.route("/admin/subjects")
+@admin_required
 def admin_subjects():
-    if not is_admin_logged_in():
-        return require_admin()
     db = get_db()
-    subjects = db.query(Subject).order_by(Subject.id.desc()).all()
-    classes = db.query(ClassRoom).order_by(ClassRoom.name, ClassRoom.section).all()
-    return render_template("subjects.html", subjects=subjects, classes=classes)
+
+    def render():
+        subjects = db.scalars(
+            select(Subject).options(selectinload(Subject.classroom)).order_by(Subject.id.desc())
+        ).all()
+        classes = list_classes(db)
+        return render_template("subjects.html", subjects=subjects, classes=classes)
+
+    return conditional_page(table_fingerprint(db, Subject, ClassRoom), render)
 
 @app.route("/admin/subjects/add", methods=["POST"])
+@admin_required
 def admin_subjects_add():
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     name = request.form.get("name", "").strip()
     class_id = request.form.get("class_id")
@@ -818,6 +1313,9 @@ def admin_subjects_add():
         flash("All fields are required", "warning")
         return redirect(url_for("admin_subjects"))
     db = get_db()
+    if db.scalar(select(exists().where(Subject.name == name, Subject.class_id == int(class_id)))):
+        flash("Subject already exists for this class", "warning")
+        return redirect(url_for("admin_subjects"))
     subj = Subject(name=name, class_id=int(class_id))
     db.add(subj)
     try:
@@ -829,36 +1327,58 @@ def admin_subjects_add():
     return redirect(url_for("admin_subjects"))
 
 @app.route("/admin/subjects/<int:subject_id>/delete", methods=["POST"])
+@admin_required
 def admin_subjects_delete(subject_id: int):
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     db = get_db()
-    subj = db.get(Subject, subject_id)
-    if not subj:
+    if not delete_subjects(db, [subject_id]):
         abort(404)
-    db.delete(subj)
     db.commit()
     flash("Subject deleted", "info")
     return redirect(url_for("admin_subjects"))
 
+# ----------------------------
+# Admin: Bulk delete
+# ----------------------------
+BULK_DELETERS: Dict[str, Tuple[Callable[..., int], str]] = {
+    "classes": (delete_classes, "admin_classes"),
+    "students": (delete_students, "admin_students"),
+    "subjects": (delete_subjects, "admin_subjects"),
+}
+
+@app.route("/admin/<entity>/bulk_delete", methods=["POST"])
+@admin_required
+def admin_bulk_delete(entity: str):
+    require_csrf()
+    if entity not in BULK_DELETERS:
+        abort(404)
+    deleter, endpoint = BULK_DELETERS[entity]
+    ids = [int(i) for i in request.form.getlist("ids") if i.isdigit()]
+    if not ids:
+        flash("Nothing selected", "warning")
+        return redirect(url_for(endpoint))
+    db = get_db()
+    count = deleter(db, ids)
+    db.commit()
+    flash(f"Deleted {count} {entity}", "info")
+    return redirect(url_for(endpoint))
+
 # ----------------------------
 # Admin: Results + CSV
 # ----------------------------
 @app.route("/admin/results/add", methods=["GET", "POST"])
+@admin_required
 def admin_results_add():
-    if not is_admin_logged_in():
-        return require_admin()
     db = get_db()
-    classes = db.query(ClassRoom).order_by(ClassRoom.name, ClassRoom.section).all()
+    classes = list_classes(db)
 
     if request.method == "GET":
         class_id = request.args.get("class_id", type=int)
         students: List[Student] = []
         subjects: List[Subject] = []
         if class_id:
-            students = db.query(Student).filter_by(class_id=class_id).order_by(Student.name).all()
-            subjects = db.query(Subject).filter_by(class_id=class_id).order_by(Subject.name).all()
+            students = db.scalars(select(Student).where(Student.class_id == class_id).order_by(Student.name)).all()
+            subjects = db.scalars(select(Subject).where(Subject.class_id == class_id).order_by(Subject.name)).all()
         return render_template("results_add.html", classes=classes, class_id=class_id, students=students, subjects=subjects)
 
     # POST
@@ -871,88 +1391,75 @@ def admin_results_add():
         flash("All fields are required", "warning")
         return redirect(url_for("admin_results_add"))
 
-    existing = db.query(Result).filter_by(student_id=student_id, subject_id=subject_id).first()
-    if existing:
-        existing.marks = marks
-        existing.max_marks = max_marks
-        msg = "Result updated"
-    else:
-        db.add(Result(student_id=student_id, subject_id=subject_id, marks=marks, max_marks=max_marks))
-        msg = "Result added"
+    db.execute(result_upsert(), dict(student_id=student_id, subject_id=subject_id, marks=marks, max_marks=max_marks))
     db.commit()
-    flash(msg, "success")
+    flash("Result saved", "success")
     return redirect(url_for("admin_results_add", class_id=request.form.get("class_id")))
 
 @app.route("/admin/results/export")
+@admin_required
 def admin_results_export():
-    if not is_admin_logged_in():
-        return require_admin()
     class_id = request.args.get("class_id", type=int)
     if not class_id:
         abort(400)
     db = get_db()
-    buf = io.StringIO()
-    w = csv.writer(buf)
-    w.writerow(["reg_no", "subject", "marks", "max_marks"])
-    rows = (
-        db.query(Result).join(Subject).join(Student)
-        .filter(Subject.class_id == class_id)
-        .all()
+    stmt = (
+        select(Student.reg_no, Subject.name, Result.marks, Result.max_marks)
+        .select_from(Result)
+        .join(Result.subject)
+        .join(Result.student)
+        .where(Subject.class_id == class_id)
     )
-    for r in rows:
-        w.writerow([r.student.reg_no, r.subject.name, r.marks, r.max_marks])
-    buf.seek(0)
-    return send_file(io.BytesIO(buf.read().encode("utf-8")), as_attachment=True, download_name="results.csv", mimetype="text/csv")
+    rows = db.execute(stmt.execution_options(yield_per=1000))
+    return csv_response("results.csv", iter_csv(["reg_no", "subject", "marks", "max_marks"], rows))
 
 @app.route("/admin/results/import/<int:class_id>", methods=["POST"])
+@admin_required
 def admin_results_import(class_id: int):
-    if not is_admin_logged_in():
-        return require_admin()
     require_csrf()
     file = request.files.get("file")
     if not file:
         flash("No file uploaded", "warning")
         return redirect(url_for("admin_results_add", class_id=class_id))
     db = get_db()
-    subs = {s.name: s.id for s in db.query(Subject).filter_by(class_id=class_id).all()}
-    students_by_reg = {s.reg_no: s.id for s in db.query(Student).filter_by(class_id=class_id).all()}
-    reader = csv.DictReader(io.StringIO(file.read().decode("utf-8")))
-    up = 0
+    if db.get(ClassRoom, class_id) is None:
+        abort(404)
+    subs = dict(db.execute(select(Subject.name, Subject.id).where(Subject.class_id == class_id)).all())
+    students_by_reg = dict(db.execute(select(Student.reg_no, Student.id).where(Student.class_id == class_id)).all())
+    reader = csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8", newline=""))
+    # Later rows for the same student/subject win, as they did row by row
+    rows = {}
     for row in reader:
         sid = students_by_reg.get(row.get("reg_no"))
         subid = subs.get(row.get("subject"))
         if not sid or not subid:
             continue
-        marks = int(row.get("marks", 0))
-        max_marks = int(row.get("max_marks", 100))
-        existing = db.query(Result).filter_by(student_id=sid, subject_id=subid).first()
-        if existing:
-            existing.marks = marks
-            existing.max_marks = max_marks
-        else:
-            db.add(Result(student_id=sid, subject_id=subid, marks=marks, max_marks=max_marks))
-        up += 1
+        rows[(sid, subid)] = dict(student_id=sid, subject_id=subid, marks=int(row.get("marks", 0)), max_marks=int(row.get("max_marks", 100)))
+    if rows:
+        db.execute(result_upsert(), list(rows.values()))
     db.commit()
-    flash(f"Imported/updated {up} results", "success")
+    flash(f"Imported/updated {len(rows)} results", "success")
     return redirect(url_for("admin_results_add", class_id=class_id))
 
 # ----------------------------
 # Admin: Staff users (role-based)
 # ----------------------------
 @app.route("/admin/users")
+@admin_required
 def admin_users():
-    if not is_admin_logged_in():
-        return require_admin()
     if current_admin_role() != "admin":
         return require_admin("admin")
     db = get_db()
-    users = db.query(AdminUser).order_by(AdminUser.id.desc()).all()
-    return render_template("admin_users.html", users=users)
+
+    def render():
+        users = db.scalars(select(AdminUser).order_by(AdminUser.id.desc())).all()
+        return render_template("admin_users.html", users=users)
+
+    return conditional_page(table_fingerprint(db, AdminUser), render)
 
 @app.route("/admin/users/add", methods=["POST"])
+@admin_required
 def admin_users_add():
-    if not is_admin_logged_in():
-        return require_admin()
     if current_admin_role() != "admin":
         return require_admin("admin")
     require_csrf()
@@ -963,7 +1470,12 @@ def admin_users_add():
         flash("All fields are required", "warning")
         return redirect(url_for("admin_users"))
     db = get_db()
-    u = AdminUser(username=username, password_hash=generate_password_hash(password), role=role)
+    # Check before hashing so a duplicate costs an index lookup, not a KDF run;
+    # the commit below still catches a concurrent insert
+    if db.scalar(select(exists().where(AdminUser.username == username))):
+        flash("Username already exists", "warning")
+        return redirect(url_for("admin_users"))
+    u = AdminUser(username=username, password_hash=hash_password(password), role=role)
     db.add(u)
     try:
         db.commit()
@@ -974,9 +1486,8 @@ def admin_users_add():
     return redirect(url_for("admin_users"))
 
 @app.route("/admin/users/<int:user_id>/delete", methods=["POST"])
+@admin_required
 def admin_users_delete(user_id: int):
-    if not is_admin_logged_in():
-        return require_admin()
     if current_admin_role() != "admin":
         return require_admin("admin")
     require_csrf()
@@ -999,45 +1510,37 @@ def student_login():
         reg_no = request.form.get("reg_no", "").strip()
         password = request.form.get("password", "")
         db = get_db()
-        student = db.query(Student).filter_by(reg_no=reg_no).first()
-        if student and check_password_hash(student.password_hash, password):
+        student = db.scalar(select(Student).where(Student.reg_no == reg_no))
+        ok = verify_password(student.password_hash if student else DUMMY_PASSWORD_HASH, password)
+        if student and ok:
+            if password_needs_rehash(student.password_hash):
+                student.password_hash = hash_password(password)
+                db.commit()
             session["student_id"] = student.id
             flash("Logged in successfully", "success")
             return redirect(url_for("student_portal"))
         flash("Invalid credentials", "warning")
-    return render_template("student_login.html")
+    return render_cached("student_login.html")
 
 @app.route("/student/portal")
 def student_portal():
-    if not is_student_logged_in():
+    s = current_student()
+    if s is None:
+        session.pop("student_id", None)
         flash("Please login first", "warning")
         return redirect(url_for("student_login"))
-    db = get_db()
-    s = db.get(Student, current_student_id())
-    results = (
-        db.query(Result)
-        .filter(Result.student_id == s.id)
-        .join(Subject)
-        .order_by(Subject.name)
-        .all()
-    )
+    results = load_results(get_db(), s.id)
     totals = compute_totals(results)
     return render_template("student_portal.html", student=s, results=results, totals=totals)
 
 @app.route("/student/marksheet")
 def student_marksheet():
-    if not is_student_logged_in():
+    s = current_student()
+    if s is None:
+        session.pop("student_id", None)
         flash("Please login first", "warning")
         return redirect(url_for("student_login"))
-    db = get_db()
-    s = db.get(Student, current_student_id())
-    results = (
-        db.query(Result)
-        .filter(Result.student_id == s.id)
-        .join(Subject)
-        .order_by(Subject.name)
-        .all()
-    )
+    results = load_results(get_db(), s.id)
     totals = compute_totals(results)
     return render_template("marksheet.html", s=s, results=results, totals=totals)
 
@@ -1055,7 +1558,7 @@ def student_reset_request():
     require_csrf()
     reg_no = request.form.get("reg_no", "").strip()
     db = get_db()
-    s = db.query(Student).filter_by(reg_no=reg_no).first()
+    s = db.scalar(select(Student).where(Student.reg_no == reg_no))
     if not s:
         flash("Registration number not found", "warning")
         return redirect(url_for("student_login"))
@@ -1084,20 +1587,11 @@ def student_reset_with_token(token: str):
         if len(newpass) < 6:
             flash("Password too short", "warning")
         else:
-            s.password_hash = generate_password_hash(newpass)
+            s.password_hash = hash_password(newpass)
             db.commit()
             flash("Password updated. Please login.", "success")
             return redirect(url_for("student_login"))
-    return (
-        """
-        <h3>Set New Password</h3>
-        <form method='post'>
-          <input type='hidden' name='csrf_token' value='""" + get_csrf_token() + """'>
-          <label>New Password <input name='password' type='password' required></label>
-          <button>Save</button>
-        </form>
-        """
-    )
+    return render_template("student_reset.html")
 
 # ----------------------------
 # DB init with default admin
@@ -1105,17 +1599,28 @@ def student_reset_with_token(token: str):
 
 def init_db():
     Base.metadata.create_all(engine)
+    # create_all() skips tables that already exist, so add newer indexes to old DBs
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    init_table_versions()
+    init_student_search()
     db = get_db()
-    if not db.query(AdminUser).filter_by(username="admin").first():
-        admin = AdminUser(username="admin", password_hash=generate_password_hash("admin123"), role="admin")
-        db.add(admin)
+    # EXISTS first so the hash is only computed on a fresh DB; ON CONFLICT keeps
+    # concurrent workers starting up at the same time from racing on the insert
+    if not db.scalar(select(exists().where(AdminUser.username == "admin"))):
+        stmt = (
+            sqlite_insert(AdminUser)
+            .values(username="admin", password_hash=hash_password("admin123"), role="admin")
+            .on_conflict_do_nothing(index_elements=["username"])
+        )
+        if db.execute(stmt).rowcount:
+            app.logger.info("Default admin created: admin/admin123")
         db.commit()
-        app.logger.info("Default admin created: admin/admin123")
 
 # ----------------------------
 # Main
 # ----------------------------
 if __name__ == "__main__":
     init_db()
-    app.jinja_env.globals['csrf_token'] = get_csrf_token
     app.run(debug=True)